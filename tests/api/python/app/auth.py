@@ -4,14 +4,15 @@ Token store and auth validation for the OpenCALL Todo API.
 
 from __future__ import annotations
 
-from typing import Union
+import sys
+from typing import Sequence, Union
 
-# token -> list of scopes
-token_store: dict[str, list[str]] = {}
+# token -> granted scopes
+token_store: dict[str, frozenset[str]] = {}
 
 
 def register_token(token: str, scopes: list[str]) -> None:
-    token_store[token] = scopes
+    token_store[token] = frozenset(sys.intern(scope) for scope in scopes)
 
 
 def reset_token_store() -> None:
@@ -20,14 +21,14 @@ def reset_token_store() -> None:
 
 def validate_auth(
     auth_header: str | None,
-    required_scopes: list[str],
+    required_scopes: Sequence[str],
 ) -> Union[
     dict,  # {"valid": True} or {"valid": False, "status": int, "code": str, "message": str}
 ]:
     if not required_scopes:
         return {"valid": True}
 
-    if not auth_header or not auth_header.startswith("Bearer "):
+    if not auth_header or auth_header[:7] != "Bearer ":
         return {
             "valid": False,
             "status": 401,
@@ -46,8 +47,7 @@ def validate_auth(
             "message": "Invalid or expired token",
         }
 
-    has_all_scopes = all(scope in entry for scope in required_scopes)
-    if not has_all_scopes:
+    if not entry.issuperset(required_scopes):
         return {
             "valid": False,
             "status": 403,
@@ -5,16 +5,27 @@ FastAPI application for the OpenCALL Todo API.
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import gzip
 import hashlib
-import json
+import os
 import uuid
 import base64
-from typing import Optional
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Mapping, Optional
+
+import orjson
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover - optional speedup
+    xxhash = None
 
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, Response, RedirectResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, RedirectResponse
 
-from .registry import build_registry
+from .registry import registry_bytes
 from .router import handle_call
 from .operations import (
     reset_storage,
@@ -24,72 +35,208 @@ from .operations import (
 )
 from .auth import register_token, reset_token_store
 from .state import get_instance, reset_instances
-from .media import get_media, reset_media
+from .media import MAX_MEDIA_BYTES, discard_spill, get_media, reset_media, spill_upload
+
 
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson instead of the stdlib encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
 
-app = FastAPI()
 
 # ---------------------------------------------------------------------------
 # Registry (computed once at startup)
 # ---------------------------------------------------------------------------
-_registry: dict = {}
-_registry_json: str = ""
+_registry_bytes: bytes = b""
 _registry_etag: str = ""
+_registry_gzip_bytes: bytes = b""
+_registry_headers: Mapping[str, str] = MappingProxyType({})
+_registry_gzip_headers: Mapping[str, str] = MappingProxyType({})
+_not_modified_headers: Mapping[str, str] = MappingProxyType({})
 
 
 def _init_registry() -> None:
-    global _registry, _registry_json, _registry_etag
-    _registry = build_registry()
-    _registry_json = json.dumps(_registry, separators=(",", ":"))
-    h = hashlib.sha256(_registry_json.encode()).hexdigest()
+    global _registry_bytes, _registry_etag, _registry_gzip_bytes
+    global _registry_headers, _registry_gzip_headers, _not_modified_headers
+    _registry_bytes = registry_bytes()
+    # The ETag is opaque to clients, so a fast non-cryptographic hash will do.
+    if xxhash is not None:
+        h = xxhash.xxh3_64(_registry_bytes).hexdigest()
+    else:
+        h = hashlib.sha256(_registry_bytes).hexdigest()
     _registry_etag = f'"{h}"'
+    # The registry never changes after startup, so bodies and headers for every
+    # variant are built once. Responses themselves are created per request:
+    # GZipMiddleware edits response headers in place. It adds Vary to the plain
+    # body on its way through; the gzip copy (already Content-Encoded) and the
+    # empty 304 pass through untouched, so they carry Vary themselves.
+    _registry_gzip_bytes = gzip.compress(_registry_bytes, compresslevel=9)
+    _registry_headers = MappingProxyType({
+        "Cache-Control": "public, max-age=3600",
+        "ETag": _registry_etag,
+    })
+    _registry_gzip_headers = MappingProxyType({
+        **_registry_headers,
+        "Vary": "Accept-Encoding",
+        "Content-Encoding": "gzip",
+    })
+    _not_modified_headers = MappingProxyType({"ETag": _registry_etag, "Vary": "Accept-Encoding"})
 
 
 # ---------------------------------------------------------------------------
 # WebSocket connection manager
 # ---------------------------------------------------------------------------
-_active_websockets: set[WebSocket] = set()
+# Each socket has its own bounded outbox of messages, drained by its own sender
+# task, so a stalled client only backs up its own outbox. A socket whose
+# outbox is full is evicted and closed.
+_active_websockets: dict[WebSocket, asyncio.Queue[str]] = {}
+# Immutable copy of _active_websockets' items, rebuilt only when a socket is
+# added or removed, so broadcasts iterate it without allocating.
+_active_ws_snapshot: tuple[tuple[WebSocket, asyncio.Queue[str]], ...] = ()
+# Captured at startup; a uvloop loop when served with `--loop uvloop`.
 _event_loop: Optional[asyncio.AbstractEventLoop] = None
+_WS_OUTBOX_MAX = 256  # messages
+# Strong references to in-flight close tasks for evicted sockets
+_closing_tasks: set[asyncio.Task] = set()
+
+
+def _add_websocket(ws: WebSocket, outbox: asyncio.Queue[str]) -> None:
+    global _active_ws_snapshot
+    _active_websockets[ws] = outbox
+    _active_ws_snapshot = tuple(_active_websockets.items())
+
+
+def _remove_websocket(ws: WebSocket) -> None:
+    global _active_ws_snapshot
+    if _active_websockets.pop(ws, None) is not None:
+        _active_ws_snapshot = tuple(_active_websockets.items())
+
+
+async def _socket_sender(ws: WebSocket, outbox: asyncio.Queue[str]) -> None:
+    """Send one socket its messages in order; stop broadcasting to it on failure."""
+    try:
+        while True:
+            await ws.send_text(await outbox.get())
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        _remove_websocket(ws)
+
+
+async def _close_quietly(ws: WebSocket) -> None:
+    with contextlib.suppress(Exception):
+        await ws.close(code=1013)  # Try Again Later
+
+
+def _evict_websocket(ws: WebSocket) -> None:
+    # Closing makes the endpoint's receive loop exit, which stops its sender.
+    _remove_websocket(ws)
+    task = asyncio.create_task(_close_quietly(ws))
+    _closing_tasks.add(task)
+    task.add_done_callback(_closing_tasks.discard)
+
+
+def _enqueue_broadcast(message: str) -> None:
+    # Runs on the event loop; hands the message to every socket's outbox
+    # without awaiting any send.
+    for ws, outbox in _active_ws_snapshot:
+        try:
+            outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            _evict_websocket(ws)
 
 
 def _broadcast(event: str, data: dict) -> None:
     """Broadcast to all active WebSocket connections."""
-    if not _active_websockets:
+    if not _active_ws_snapshot:
         return
-    message = json.dumps(data)
-    dead: list[WebSocket] = []
-    for ws in list(_active_websockets):
-        try:
-            if _event_loop is not None and _event_loop.is_running():
-                _event_loop.create_task(ws.send_text(message))
-            else:
-                # Try to get the current running loop
-                try:
-                    loop = asyncio.get_running_loop()
-                    loop.create_task(ws.send_text(message))
-                except RuntimeError:
-                    dead.append(ws)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        _active_websockets.discard(ws)
+    if _event_loop is None or not _event_loop.is_running():
+        return
+    # Encoded once for all sockets. Frames stay text: the stream is declared as
+    # "json" encoding and clients JSON.parse text frames, and ASGI only accepts
+    # str for text sends, so the per-socket UTF-8 step lives in the server.
+    message = orjson.dumps(data).decode()
+    _event_loop.call_soon_threadsafe(_enqueue_broadcast, message)
 
 
 # ---------------------------------------------------------------------------
-# Startup
+# Lifespan
 # ---------------------------------------------------------------------------
 
-@app.on_event("startup")
-async def startup() -> None:
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     global _event_loop
     _event_loop = asyncio.get_running_loop()
+    # Registry encoding and hashing is pure CPU; run it off-loop while the
+    # in-memory stores are reset.
+    registry_ready = asyncio.create_task(asyncio.to_thread(_init_registry))
     reset_storage()
     reset_token_store()
     reset_instances()
     reset_media()
     reset_stream_sessions()
-    _init_registry()
+    await registry_ready
     set_broadcast_fn(_broadcast)
+    try:
+        yield
+    finally:
+        # Spill files outlive the process otherwise
+        reset_media()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+
+# ---------------------------------------------------------------------------
+# Error responses
+# ---------------------------------------------------------------------------
+
+def _error_response(
+    status_code: int,
+    code: str,
+    message: str,
+    request_id: Optional[str] = None,
+) -> Response:
+    payload = {
+        "requestId": request_id if request_id is not None else str(uuid.uuid4()),
+        "state": "error",
+        "error": {"code": code, "message": message},
+    }
+    return Response(
+        content=orjson.dumps(payload),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+
+# Static error bodies are encoded once; only the requestId is spliced in.
+
+def _encode_error_tail(code: str, message: str) -> bytes:
+    # Everything after the requestId member, without the leading "{".
+    return orjson.dumps({"state": "error", "error": {"code": code, "message": message}})[1:]
+
+
+_METHOD_NOT_ALLOWED_TAIL = _encode_error_tail(
+    "METHOD_NOT_ALLOWED",
+    "Use POST /call to invoke operations. Discover available operations at GET /.well-known/ops",
+)
+_MISSING_ENVELOPE_TAIL = _encode_error_tail(
+    "INVALID_REQUEST", "Missing envelope part in multipart request"
+)
+_INVALID_MULTIPART_TAIL = _encode_error_tail("INVALID_REQUEST", "Invalid multipart request")
+_INVALID_JSON_TAIL = _encode_error_tail("INVALID_REQUEST", "Invalid JSON in request body")
+
+
+def _static_error(status_code: int, tail: bytes, headers: Optional[dict] = None) -> Response:
+    content = b"".join((b'{"requestId":"', str(uuid.uuid4()).encode(), b'",', tail))
+    return Response(
+        content=content,
+        status_code=status_code,
+        media_type="application/json",
+        headers=headers,
+    )
 
 
 # ---------------------------------------------------------------------------
@@ -98,39 +245,32 @@ async def startup() -> None:
 
 @app.get("/.well-known/ops")
 async def well_known_ops(request: Request) -> Response:
-    if_none_match = request.headers.get("if-none-match")
-    if if_none_match == _registry_etag:
-        return Response(status_code=304)
+    headers = request.headers
+    if headers.get("if-none-match") == _registry_etag:
+        return Response(status_code=304, headers=_not_modified_headers)
+    if "gzip" in headers.get("accept-encoding", ""):
+        return Response(
+            content=_registry_gzip_bytes,
+            media_type="application/json",
+            headers=_registry_gzip_headers,
+        )
     return Response(
-        content=_registry_json,
-        status_code=200,
+        content=_registry_bytes,
         media_type="application/json",
-        headers={
-            "Cache-Control": "public, max-age=3600",
-            "ETag": _registry_etag,
-        },
+        headers=_registry_headers,
     )
 
 
 @app.get("/call")
-async def get_call_not_allowed() -> JSONResponse:
-    return JSONResponse(
-        status_code=405,
-        content={
-            "requestId": str(uuid.uuid4()),
-            "state": "error",
-            "error": {
-                "code": "METHOD_NOT_ALLOWED",
-                "message": "Use POST /call to invoke operations. Discover available operations at GET /.well-known/ops",
-            },
-        },
-        headers={"Allow": "POST"},
-    )
+async def get_call_not_allowed() -> Response:
+    return _static_error(405, _METHOD_NOT_ALLOWED_TAIL, headers={"Allow": "POST"})
 
 
 @app.post("/call")
-async def call_endpoint(request: Request) -> JSONResponse:
-    content_type = request.headers.get("content-type", "")
+async def call_endpoint(request: Request) -> Response:
+    headers = request.headers
+    content_type = headers.get("content-type", "")
+    auth_header = headers.get("authorization")
     envelope = None
     media_file = None
 
@@ -139,125 +279,81 @@ async def call_endpoint(request: Request) -> JSONResponse:
             form = await request.form()
             envelope_part = form.get("envelope")
             if envelope_part is None:
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "requestId": str(uuid.uuid4()),
-                        "state": "error",
-                        "error": {
-                            "code": "INVALID_REQUEST",
-                            "message": "Missing envelope part in multipart request",
-                        },
-                    },
-                )
+                return _static_error(400, _MISSING_ENVELOPE_TAIL)
             if hasattr(envelope_part, "read"):
                 # It's an UploadFile
                 raw = await envelope_part.read()
-                envelope = json.loads(raw)
+                envelope = orjson.loads(raw)
             else:
-                envelope = json.loads(str(envelope_part))
+                envelope = orjson.loads(str(envelope_part))
 
             file_part = form.get("file")
             if file_part is not None and hasattr(file_part, "read"):
-                data = await file_part.read()
+                # The parser has already spooled the part; copy it to a spill
+                # file in a worker thread rather than reading it into memory.
+                # Oversized uploads are not copied, as attach rejects them.
+                size = file_part.size
+                if size is None:
+                    size = file_part.file.seek(0, os.SEEK_END)
+                path = None
+                if size <= MAX_MEDIA_BYTES:
+                    await file_part.seek(0)
+                    path = await asyncio.to_thread(spill_upload, file_part.file)
                 media_file = {
-                    "data": data,
+                    "path": path,
+                    "size": size,
                     "content_type": file_part.content_type or "application/octet-stream",
                     "filename": file_part.filename or "upload",
                 }
-        except json.JSONDecodeError:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "requestId": str(uuid.uuid4()),
-                    "state": "error",
-                    "error": {
-                        "code": "INVALID_REQUEST",
-                        "message": "Invalid multipart request",
-                    },
-                },
-            )
         except Exception:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "requestId": str(uuid.uuid4()),
-                    "state": "error",
-                    "error": {
-                        "code": "INVALID_REQUEST",
-                        "message": "Invalid multipart request",
-                    },
-                },
-            )
+            return _static_error(400, _INVALID_MULTIPART_TAIL)
     else:
         try:
             body = await request.body()
-            envelope = json.loads(body)
-        except (json.JSONDecodeError, Exception):
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "requestId": str(uuid.uuid4()),
-                    "state": "error",
-                    "error": {
-                        "code": "INVALID_REQUEST",
-                        "message": "Invalid JSON in request body",
-                    },
-                },
-            )
-
-    auth_header = request.headers.get("authorization")
-    result = handle_call(envelope, auth_header, media_file)
-    return JSONResponse(status_code=result["status"], content=result["body"])
+            envelope = orjson.loads(body)
+        except Exception:
+            return _static_error(400, _INVALID_JSON_TAIL)
+
+    try:
+        result = handle_call(envelope, auth_header, media_file)
+    finally:
+        # Attach takes the spill file over; anything else leaves it to us
+        if media_file is not None and media_file["path"] is not None:
+            discard_spill(media_file["path"])
+    body_bytes = result.get("body_bytes")
+    if body_bytes is not None:
+        return Response(
+            content=body_bytes,
+            status_code=result["status"],
+            media_type="application/json",
+        )
+    return ORJSONResponse(status_code=result["status"], content=result["body"])
 
 
 @app.get("/ops/{request_id}/chunks")
-async def get_chunks(request_id: str, request: Request) -> JSONResponse:
+async def get_chunks(request_id: str, request: Request) -> Response:
     instance = get_instance(request_id)
     if instance is None:
-        return JSONResponse(
-            status_code=404,
-            content={
-                "requestId": request_id,
-                "state": "error",
-                "error": {
-                    "code": "NOT_FOUND",
-                    "message": f"Operation {request_id} not found",
-                },
-            },
-        )
+        return _error_response(404, "NOT_FOUND", f"Operation {request_id} not found", request_id)
 
     if instance.state != "complete" or not instance.chunks or len(instance.chunks) == 0:
-        return JSONResponse(
-            status_code=400,
-            content={
-                "requestId": request_id,
-                "state": "error",
-                "error": {
-                    "code": "NOT_READY",
-                    "message": "Operation not yet complete or has no chunks",
-                },
-            },
+        return _error_response(
+            400, "NOT_READY", "Operation not yet complete or has no chunks", request_id
         )
 
     cursor_param = request.query_params.get("cursor")
     chunk_index = 0
     if cursor_param:
         try:
-            offset = int(base64.b64decode(cursor_param).decode())
-            found = False
-            for i, c in enumerate(instance.chunks):
-                if c.offset == offset:
-                    chunk_index = i
-                    found = True
-                    break
-            if not found:
-                chunk_index = 0
-        except Exception:
+            # Tolerate URL-safe alphabets and stripped padding
+            padded = cursor_param + "=" * (-len(cursor_param) % 4)
+            offset = int(base64.urlsafe_b64decode(padded))
+            chunk_index = instance.offset_to_index.get(offset, 0)
+        except ValueError:
             chunk_index = 0
 
     chunk = instance.chunks[chunk_index]
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=200,
         content={
             "requestId": request_id,
@@ -267,20 +363,10 @@ async def get_chunks(request_id: str, request: Request) -> JSONResponse:
 
 
 @app.get("/ops/{request_id}")
-async def poll_operation(request_id: str) -> JSONResponse:
+async def poll_operation(request_id: str) -> Response:
     instance = get_instance(request_id)
     if instance is None:
-        return JSONResponse(
-            status_code=404,
-            content={
-                "requestId": request_id,
-                "state": "error",
-                "error": {
-                    "code": "NOT_FOUND",
-                    "message": f"Operation {request_id} not found",
-                },
-            },
-        )
+        return _error_response(404, "NOT_FOUND", f"Operation {request_id} not found", request_id)
 
     body: dict = {
         "requestId": instance.request_id,
@@ -294,28 +380,27 @@ async def poll_operation(request_id: str) -> JSONResponse:
         body["retryAfterMs"] = instance.retry_after_ms
     body["expiresAt"] = instance.expires_at
 
-    return JSONResponse(status_code=200, content=body)
+    return ORJSONResponse(status_code=200, content=body)
 
 
 @app.get("/media/{media_id}/data")
 async def media_data(media_id: str) -> Response:
     media = get_media(media_id)
     if media is None:
-        return JSONResponse(
-            status_code=404,
-            content={
-                "requestId": str(uuid.uuid4()),
-                "state": "error",
-                "error": {"code": "NOT_FOUND", "message": "Media not found"},
-            },
+        return _error_response(404, "NOT_FOUND", "Media not found")
+    if media.path is None:
+        # Attached by reference: there are no stored bytes
+        return Response(
+            status_code=200,
+            media_type=media.content_type,
+            headers={"Content-Disposition": media.content_disposition},
         )
-    return Response(
-        content=media.data,
+    # Streamed from the spill file in chunks (uvicorn offers no pathsend)
+    return FileResponse(
+        media.path,
         status_code=200,
         media_type=media.content_type,
-        headers={
-            "Content-Disposition": f'attachment; filename="{media.filename}"',
-        },
+        headers={"Content-Disposition": media.content_disposition},
     )
 
 
@@ -323,14 +408,7 @@ async def media_data(media_id: str) -> Response:
 async def media_redirect(media_id: str) -> Response:
     media = get_media(media_id)
     if media is None:
-        return JSONResponse(
-            status_code=404,
-            content={
-                "requestId": str(uuid.uuid4()),
-                "state": "error",
-                "error": {"code": "NOT_FOUND", "message": "Media not found"},
-            },
-        )
+        return _error_response(404, "NOT_FOUND", "Media not found")
     return Response(
         status_code=303,
         headers={"Location": f"/media/{media_id}/data"},
@@ -338,10 +416,10 @@ async def media_redirect(media_id: str) -> Response:
 
 
 @app.post("/_internal/tokens")
-async def internal_tokens(request: Request) -> JSONResponse:
-    body = await request.json()
+async def internal_tokens(request: Request) -> ORJSONResponse:
+    body = orjson.loads(await request.body())
     register_token(body["token"], body["scopes"])
-    return JSONResponse(status_code=200, content={"ok": True})
+    return ORJSONResponse(status_code=200, content={"ok": True})
 
 
 @app.websocket("/streams/{session_id}")
@@ -352,7 +430,9 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str) -> None:
         return
 
     await websocket.accept()
-    _active_websockets.add(websocket)
+    outbox: asyncio.Queue[str] = asyncio.Queue(maxsize=_WS_OUTBOX_MAX)
+    sender = asyncio.create_task(_socket_sender(websocket, outbox))
+    _add_websocket(websocket, outbox)
     try:
         while True:
             # Keep connection alive; we don't expect inbound messages
@@ -362,4 +442,5 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str) -> None:
     except Exception:
         pass
     finally:
-        _active_websockets.discard(websocket)
+        _remove_websocket(websocket)
+        sender.cancel()
@@ -1,39 +1,95 @@
 """
-In-memory media storage for the OpenCALL Todo API.
+Media storage for the OpenCALL Todo API.
+Uploads are indexed in memory and their bytes spilled to temp files.
 """
 
 from __future__ import annotations
 
+import os
+import shutil
+import tempfile
 import uuid
 from dataclasses import dataclass
-from typing import Optional
+from typing import BinaryIO, Optional
 
 
-ACCEPTED_MEDIA_TYPES = ["image/png", "image/jpeg", "application/pdf", "text/plain"]
+_ACCEPTED_MEDIA_ORDER = ("image/png", "image/jpeg", "application/pdf", "text/plain")
+ACCEPTED_MEDIA_TYPES = frozenset(_ACCEPTED_MEDIA_ORDER)
+ACCEPTED_MEDIA_TYPES_TEXT = ", ".join(_ACCEPTED_MEDIA_ORDER)  # for error messages
 MAX_MEDIA_BYTES = 10 * 1024 * 1024  # 10 MB
 
 
-@dataclass
+@dataclass(slots=True)
 class StoredMedia:
     id: str
-    data: bytes
+    path: Optional[str]  # spill file on disk; None for ref attachments
+    size: int
     content_type: str
     filename: str
+    content_disposition: str
 
 
 _media_store: dict[str, StoredMedia] = {}
 
 
-def store_media(data: bytes, content_type: str, filename: str) -> StoredMedia:
-    media_id = str(uuid.uuid4())
-    media = StoredMedia(id=media_id, data=data, content_type=content_type, filename=filename)
-    _media_store[media_id] = media
+def _register(path: Optional[str], size: int, content_type: str, filename: str) -> StoredMedia:
+    media = StoredMedia(
+        id=str(uuid.uuid4()),
+        path=path,
+        size=size,
+        content_type=content_type,
+        filename=filename,
+        content_disposition=f'attachment; filename="{filename}"',
+    )
+    _media_store[media.id] = media
     return media
 
 
+def spill_upload(source: BinaryIO) -> str:
+    """Copy an upload stream (read from its current position) to a spill file.
+
+    This does blocking file I/O; call it off the event loop. The caller owns
+    the returned path until store_media takes it over.
+    """
+    with tempfile.NamedTemporaryFile(prefix="opencall-media-", delete=False) as f:
+        try:
+            shutil.copyfileobj(source, f)
+        except BaseException:
+            f.close()
+            discard_spill(f.name)
+            raise
+    return f.name
+
+
+def discard_spill(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def store_media(path: str, size: int, content_type: str, filename: str) -> StoredMedia:
+    """Register a spill file written by spill_upload; the store now owns it."""
+    return _register(path, size, content_type, filename)
+
+
+def store_media_ref(content_type: str, filename: str) -> StoredMedia:
+    """Record an attachment given by reference; it has no bytes on disk."""
+    return _register(None, 0, content_type, filename)
+
+
 def get_media(media_id: str) -> Optional[StoredMedia]:
     return _media_store.get(media_id)
 
 
+def discard_media(media_id: str) -> None:
+    media = _media_store.pop(media_id, None)
+    if media is not None and media.path is not None:
+        discard_spill(media.path)
+
+
 def reset_media() -> None:
+    for media in _media_store.values():
+        if media.path is not None:
+            discard_spill(media.path)
     _media_store.clear()
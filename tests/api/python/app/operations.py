@@ -4,14 +4,27 @@ All operation handlers for the OpenCALL Todo API.
 
 from __future__ import annotations
 
+import csv
+import functools
+import io
 import uuid
-import base64
+import heapq
+import itertools
 import threading
-from datetime import datetime, timezone
-from typing import Any, Callable, Optional
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, Optional
 
-from .state import create_instance, transition_to, build_chunks
-from .media import store_media, ACCEPTED_MEDIA_TYPES, MAX_MEDIA_BYTES
+import orjson
+from sortedcontainers import SortedList
+
+from .state import Chunk, create_instance, transition_to, build_chunks
+from .media import discard_media, store_media, store_media_ref, ACCEPTED_MEDIA_TYPES, ACCEPTED_MEDIA_TYPES_TEXT, MAX_MEDIA_BYTES
 
 
 # ---------------------------------------------------------------------------
@@ -55,25 +68,177 @@ def reset_stream_sessions() -> None:
     _broadcast_fn = None
 
 
+# ---------------------------------------------------------------------------
+# Background scheduler
+# ---------------------------------------------------------------------------
+
+class _Scheduler:
+    """
+    Runs delayed callbacks on one daemon thread, ordered by a deadline heap,
+    instead of starting an OS thread per delay.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, Callable[[], None]]] = []
+        self._seq = itertools.count()  # tie-breaker so callables never compare
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, delay: float, fn: Callable[[], None]) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                deadline, _, fn = self._heap[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(timeout=remaining)
+                    continue
+                heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception:
+                # Report like threading.Timer would, but keep the worker alive
+                traceback.print_exc()
+
+
+_scheduler = _Scheduler()
+
+
 # ---------------------------------------------------------------------------
 # In-memory storage
 # ---------------------------------------------------------------------------
 
+# Stored todos are never mutated in place: writers publish a fresh dict under
+# _todos_lock, so readers can hand out whatever _todos.get() returns.
 _todos: dict[str, dict] = {}
-_idempotency_store: dict[str, Any] = {}
+_todos_lock = threading.RLock()
+# Bumped by every write under _todos_lock; keys the export cache
+_store_version = 0
+# idempotency key -> (status, serialized response body)
+_idempotency_store: dict[str, tuple[int, bytes]] = {}
+# id -> lowercased title, kept beside the todo so responses stay clean
+_title_lower: dict[str, str] = {}
+# id -> distinct labels as last indexed, so unindexing needs no rebuild
+_label_sets: dict[str, frozenset[str]] = {}
+
+# Sorted (createdAt, id) keys used for keyset pagination. The filter indexes
+# hold the same keys for the todos matching each completed/label value.
+_todos_index: SortedList = SortedList()
+_completed_index: dict[bool, SortedList] = {True: SortedList(), False: SortedList()}
+_label_index: dict[str, SortedList] = {}
+# Unordered id sets per filter value, for intersecting combined filters
+_by_completed: dict[bool, set[str]] = {True: set(), False: set()}
+_by_label: dict[str, set[str]] = {}
+
+
+def _touch_store() -> None:
+    global _store_version
+    _store_version += 1
+
 
+# Callers outside this module get read-only views; writes stay in here
+_todos_view: Mapping[str, dict] = MappingProxyType(_todos)
+_idempotency_view: Mapping[str, tuple[int, bytes]] = MappingProxyType(_idempotency_store)
 
-def get_todos_store() -> dict[str, dict]:
-    return _todos
 
+def get_todos_store() -> Mapping[str, dict]:
+    return _todos_view
 
-def get_idempotency_store() -> dict[str, Any]:
-    return _idempotency_store
+
+def get_idempotency_store() -> Mapping[str, tuple[int, bytes]]:
+    return _idempotency_view
+
+
+def store_idempotent_response(key: str, status: int, body_bytes: bytes) -> None:
+    _idempotency_store[key] = (status, body_bytes)
 
 
 def reset_storage() -> None:
-    _todos.clear()
-    _idempotency_store.clear()
+    with _todos_lock:
+        _touch_store()
+        _export_cache.clear()
+        _todos.clear()
+        _idempotency_store.clear()
+        _title_lower.clear()
+        _label_sets.clear()
+        _todos_index.clear()
+        _completed_index[True].clear()
+        _completed_index[False].clear()
+        _label_index.clear()
+        _by_completed[True].clear()
+        _by_completed[False].clear()
+        _by_label.clear()
+
+
+_NO_LABELS: frozenset[str] = frozenset()
+
+
+def _index_key(todo: dict) -> tuple[str, str]:
+    return (todo["createdAt"], todo["id"])
+
+
+def _index_todo(todo: dict) -> None:
+    key = _index_key(todo)
+    todo_id = key[1]
+    completed = bool(todo.get("completed"))
+    _todos_index.add(key)
+    _completed_index[completed].add(key)
+    _by_completed[completed].add(todo_id)
+    labels = todo.get("labels")
+    label_set = _label_sets[todo_id] = frozenset(labels) if labels else _NO_LABELS
+    for label in label_set:
+        index = _label_index.get(label)
+        if index is None:
+            index = _label_index[label] = SortedList()
+            _by_label[label] = set()
+        index.add(key)
+        _by_label[label].add(todo_id)
+
+
+def _unindex_todo(todo: dict) -> None:
+    key = _index_key(todo)
+    todo_id = key[1]
+    completed = bool(todo.get("completed"))
+    _todos_index.discard(key)
+    _completed_index[completed].discard(key)
+    _by_completed[completed].discard(todo_id)
+    for label in _label_sets.pop(todo_id, _NO_LABELS):
+        index = _label_index.get(label)
+        if index is not None:
+            index.discard(key)
+            _by_label[label].discard(todo_id)
+            if not index:
+                del _label_index[label]
+                del _by_label[label]
+
+
+def _mark_completed(todo: dict) -> None:
+    key = _index_key(todo)
+    _completed_index[False].discard(key)
+    _completed_index[True].add(key)
+    _by_completed[False].discard(key[1])
+    _by_completed[True].add(key[1])
+
+
+def _encode_cursor(key: tuple[str, str]) -> str:
+    # Plain "createdAt|id": the cursor is opaque to clients but not a secret
+    return f"{key[0]}|{key[1]}"
+
+
+def _decode_cursor(cursor: str) -> Optional[tuple[str, str]]:
+    created_at, sep, todo_id = cursor.partition("|")
+    if not sep:
+        return None
+    return (created_at, todo_id)
 
 
 # ---------------------------------------------------------------------------
@@ -95,92 +260,182 @@ class ServerError(Exception):
 
 
 def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
-
-
-def _validate_string(args: dict, field: str, required: bool = False) -> Optional[str]:
-    val = args.get(field)
-    if val is None:
-        if required:
-            raise ValidationError(f"{field}: Required")
-        return None
-    if not isinstance(val, str):
-        raise ValidationError(f"{field}: Expected string, received {type(val).__name__}")
-    return val
-
+    secs, ns = divmod(time.time_ns(), 1_000_000_000)
+    tm = time.gmtime(secs)
+    return (
+        f"{tm.tm_year:04d}-{tm.tm_mon:02d}-{tm.tm_mday:02d}"
+        f"T{tm.tm_hour:02d}:{tm.tm_min:02d}:{tm.tm_sec:02d}.{ns // 1000:06d}Z"
+    )
 
-def _validate_int(args: dict, field: str, required: bool = False,
-                   minimum: Optional[int] = None, maximum: Optional[int] = None,
-                   default: Optional[int] = None) -> Optional[int]:
-    val = args.get(field)
-    if val is None:
-        if required:
-            raise ValidationError(f"{field}: Required")
-        return default
-    if isinstance(val, bool):
-        raise ValidationError(f"{field}: Expected number, received boolean")
-    if not isinstance(val, (int, float)):
-        raise ValidationError(f"{field}: Expected number, received {type(val).__name__}")
-    val = int(val)
-    if minimum is not None and val < minimum:
-        raise ValidationError(f"{field}: Number must be greater than or equal to {minimum}")
-    if maximum is not None and val > maximum:
-        raise ValidationError(f"{field}: Number must be less than or equal to {maximum}")
-    return val
-
-
-def _validate_bool(args: dict, field: str, required: bool = False) -> Optional[bool]:
-    val = args.get(field)
-    if val is None:
-        if required:
-            raise ValidationError(f"{field}: Required")
-        return None
-    if not isinstance(val, bool):
-        raise ValidationError(f"{field}: Expected boolean, received {type(val).__name__}")
-    return val
 
+# ---------------------------------------------------------------------------
+# Argument validators
+#
+# Each operation's args are checked by a function generated once at import
+# from a field spec, so a request runs straight-line checks with no per-field
+# helper calls. Fields are (name, kind, required[, options]) with kind one of
+# "string", "int", "bool", "string[]" or "enum"; the generated function
+# returns the validated values as a tuple in spec order. Type checks compare
+# type() identity: args come from a JSON decoder, which never yields subclasses.
+# ---------------------------------------------------------------------------
 
-def _validate_string_array(args: dict, field: str, required: bool = False) -> Optional[list[str]]:
-    val = args.get(field)
-    if val is None:
+def _field_checks(var: str, field: str, kind: str, opts: dict, ns: dict) -> list[str]:
+    """Source lines validating a non-None `var`, indented for an else: block."""
+    def received(expected: str) -> str:
+        return f"{field}: Expected {expected}, received "
+
+    if kind == "string":
+        return [
+            f"        if type({var}) is not str:",
+            f"            raise ValidationError({received('string')!r} + type({var}).__name__)",
+        ]
+    if kind == "bool":
+        return [
+            f"        if type({var}) is not bool:",
+            f"            raise ValidationError({received('boolean')!r} + type({var}).__name__)",
+        ]
+    if kind == "int":
+        lines = [
+            f"        if type({var}) is bool:",
+            f"            raise ValidationError({received('number') + 'boolean'!r})",
+            f"        if type({var}) is not int and type({var}) is not float:",
+            f"            raise ValidationError({received('number')!r} + type({var}).__name__)",
+            f"        {var} = int({var})",
+        ]
+        if opts.get("minimum") is not None:
+            minimum = opts["minimum"]
+            lines += [
+                f"        if {var} < {minimum!r}:",
+                f"            raise ValidationError({f'{field}: Number must be greater than or equal to {minimum}'!r})",
+            ]
+        if opts.get("maximum") is not None:
+            maximum = opts["maximum"]
+            lines += [
+                f"        if {var} > {maximum!r}:",
+                f"            raise ValidationError({f'{field}: Number must be less than or equal to {maximum}'!r})",
+            ]
+        return lines
+    if kind == "string[]":
+        return [
+            f"        if type({var}) is not list:",
+            f"            raise ValidationError({received('array')!r} + type({var}).__name__)",
+            f"        for i, item in enumerate({var}):",
+            "            if type(item) is not str:",
+            "                raise ValidationError(",
+            f"                    {field!r} + '.' + str(i) + ': Expected string, received ' + type(item).__name__",
+            "                )",
+        ]
+    if kind == "enum":
+        # Membership is a hash lookup; the message keeps the spec's order
+        options = opts["options"]
+        ns[f"{var}_options"] = frozenset(options)
+        expected = f"{field}: Invalid enum value. Expected {' | '.join(repr(o) for o in options)}, received '"
+        return [
+            f"        if type({var}) is not str:",
+            f"            raise ValidationError({received('string')!r} + type({var}).__name__)",
+            f"        if {var} not in {var}_options:",
+            f"            raise ValidationError({expected!r} + {var} + \"'\")",
+        ]
+    raise ValueError(f"Unknown field kind: {kind}")
+
+
+def _compile_validator(name: str, fields: list[tuple]) -> Callable[[dict], tuple]:
+    ns: dict[str, Any] = {"ValidationError": ValidationError}
+    lines = [f"def {name}(args):"]
+    names = []
+    for i, spec in enumerate(fields):
+        field, kind, required = spec[:3]
+        opts = spec[3] if len(spec) > 3 else {}
+        var = f"v{i}"
+        names.append(var)
+        lines.append(f"    {var} = args.get({field!r})")
+        lines.append(f"    if {var} is None:")
         if required:
-            raise ValidationError(f"{field}: Required")
-        return None
-    if not isinstance(val, list):
-        raise ValidationError(f"{field}: Expected array, received {type(val).__name__}")
-    for i, item in enumerate(val):
-        if not isinstance(item, str):
-            raise ValidationError(f"{field}.{i}: Expected string, received {type(item).__name__}")
-    return val
-
-
-def _validate_enum(args: dict, field: str, options: list[str],
-                    required: bool = False, default: Optional[str] = None) -> Optional[str]:
-    val = args.get(field)
-    if val is None:
-        if required:
-            raise ValidationError(f"{field}: Required")
-        return default
-    if not isinstance(val, str):
-        raise ValidationError(f"{field}: Expected string, received {type(val).__name__}")
-    if val not in options:
-        raise ValidationError(
-            f"{field}: Invalid enum value. Expected {' | '.join(repr(o) for o in options)}, received '{val}'"
-        )
-    return val
+            lines.append(f"        raise ValidationError({field + ': Required'!r})")
+        else:
+            lines.append(f"        {var} = {opts.get('default')!r}")
+        lines.append("    else:")
+        lines.extend(_field_checks(var, field, kind, opts, ns))
+    lines.append(f"    return ({', '.join(names)},)")
+    exec("\n".join(lines), ns)
+    return ns[name]
+
+
+_LIMIT = ("limit", "int", False, {"minimum": 1, "maximum": 100, "default": 20})
+
+_todos_create_args = _compile_validator("todos_create_args", [
+    ("title", "string", True),
+    ("description", "string", False),
+    ("dueDate", "string", False),
+    ("labels", "string[]", False),
+])
+_todo_id_args = _compile_validator("todo_id_args", [
+    ("id", "string", True),
+])
+_todos_list_args = _compile_validator("todos_list_args", [
+    ("cursor", "string", False),
+    _LIMIT,
+    ("completed", "bool", False),
+    ("label", "string", False),
+])
+_todos_update_args = _compile_validator("todos_update_args", [
+    ("id", "string", True),
+    ("title", "string", False),
+    ("description", "string", False),
+    ("dueDate", "string", False),
+    ("labels", "string[]", False),
+    ("completed", "bool", False),
+])
+_todos_export_args = _compile_validator("todos_export_args", [
+    ("format", "enum", False, {"options": ["csv", "json"], "default": "csv"}),
+])
+_reports_generate_args = _compile_validator("reports_generate_args", [
+    ("type", "enum", False, {"options": ["summary", "detailed"], "default": "summary"}),
+])
+_todos_search_args = _compile_validator("todos_search_args", [
+    ("query", "string", True),
+    _LIMIT,
+])
+_debug_simulate_error_args = _compile_validator("debug_simulate_error_args", [
+    ("statusCode", "int", True),
+    ("code", "string", False),
+    ("message", "string", False),
+])
+_todos_watch_args = _compile_validator("todos_watch_args", [
+    ("filter", "enum", False, {"options": ["all", "completed", "pending"], "default": "all"}),
+])
+_todos_attach_args = _compile_validator("todos_attach_args", [
+    ("todoId", "string", True),
+    ("ref", "string", False),
+])
 
 
 # ---------------------------------------------------------------------------
 # Operation handlers
 # ---------------------------------------------------------------------------
 
+def _err_not_found(todo_id: str) -> dict:
+    return {
+        "ok": False,
+        "error": {"code": "TODO_NOT_FOUND", "message": f"Todo with id '{todo_id}' not found"},
+    }
+
+
+# Shared stand-in for missing args; handlers only read their args
+_EMPTY_ARGS: dict[str, Any] = {}
+
+
+def _defaults(fn: Callable[..., dict]) -> Callable[..., dict]:
+    """Pass _EMPTY_ARGS to a handler called with args=None."""
+    @functools.wraps(fn)
+    def wrapper(args: Optional[dict], *rest: Any) -> dict:
+        return fn(_EMPTY_ARGS if args is None else args, *rest)
+    return wrapper
+
+
+@_defaults
 def todos_create(args: dict) -> dict:
-    if args is None:
-        args = {}
-    title = _validate_string(args, "title", required=True)
-    description = _validate_string(args, "description")
-    due_date = _validate_string(args, "dueDate")
-    labels = _validate_string_array(args, "labels")
+    title, description, due_date, labels = _todos_create_args(args)
 
     now = _now_iso()
     todo: dict[str, Any] = {
@@ -198,53 +453,67 @@ def todos_create(args: dict) -> dict:
     if labels is not None:
         todo["labels"] = labels
 
-    _todos[todo["id"]] = todo
+    with _todos_lock:
+        _touch_store()
+        _todos[todo["id"]] = todo
+        _title_lower[todo["id"]] = title.lower()
+        _index_todo(todo)
     broadcast("created", {"event": "created", "todo": todo, "timestamp": now})
     return {"ok": True, "result": todo}
 
 
+@_defaults
 def todos_get(args: dict) -> dict:
-    if args is None:
-        args = {}
-    todo_id = _validate_string(args, "id", required=True)
+    (todo_id,) = _todo_id_args(args)
     todo = _todos.get(todo_id)
     if not todo:
-        return {
-            "ok": False,
-            "error": {"code": "TODO_NOT_FOUND", "message": f"Todo with id '{todo_id}' not found"},
-        }
+        return _err_not_found(todo_id)
     return {"ok": True, "result": todo}
 
 
+@_defaults
 def todos_list(args: dict) -> dict:
-    if args is None:
-        args = {}
-    cursor = _validate_string(args, "cursor")
-    limit = _validate_int(args, "limit", minimum=1, maximum=100, default=20)
-    completed = _validate_bool(args, "completed")
-    label = _validate_string(args, "label")
-
-    items = list(_todos.values())
-
-    # Apply filters
-    if completed is not None:
-        items = [t for t in items if t.get("completed") == completed]
-    if label is not None:
-        items = [t for t in items if label in (t.get("labels") or [])]
-
-    total = len(items)
-
-    # Cursor pagination
-    start_index = 0
-    if cursor:
-        try:
-            start_index = int(base64.b64decode(cursor).decode())
-        except Exception:
-            start_index = 0
-
-    paged = items[start_index:start_index + limit]
-    next_index = start_index + limit
-    next_cursor = base64.b64encode(str(next_index).encode()).decode() if next_index < total else None
+    cursor, limit, completed, label = _todos_list_args(args)
+
+    # Walk the smallest sorted index that satisfies one filter; with both
+    # filters, membership in the other filter's id set is checked inline.
+    other_ids: Optional[set[str]] = None
+    if label is not None and completed is not None:
+        label_index = _label_index.get(label) or SortedList()
+        completed_index = _completed_index[completed]
+        label_ids = _by_label.get(label, set())
+        completed_ids = _by_completed[completed]
+        if len(label_index) <= len(completed_index):
+            index, other_ids = label_index, completed_ids
+        else:
+            index, other_ids = completed_index, label_ids
+        total = len(label_ids & completed_ids)
+    elif label is not None:
+        index = _label_index.get(label) or SortedList()
+        total = len(index)
+    elif completed is not None:
+        index = _completed_index[completed]
+        total = len(index)
+    else:
+        index = _todos_index
+        total = len(index)
+
+    # Keyset pagination: the cursor is the last (createdAt, id) returned
+    after = _decode_cursor(cursor) if cursor else None
+    keys = index.irange(minimum=after, inclusive=(False, True)) if after else iter(index)
+
+    paged: list[dict] = []
+    last_key: Optional[tuple[str, str]] = None
+    has_more = False
+    for key in keys:
+        if other_ids is not None and key[1] not in other_ids:
+            continue
+        if len(paged) == limit:
+            has_more = True
+            break
+        paged.append(_todos[key[1]])
+        last_key = key
+    next_cursor = _encode_cursor(last_key) if has_more and last_key else None
 
     return {
         "ok": True,
@@ -252,22 +521,9 @@ def todos_list(args: dict) -> dict:
     }
 
 
+@_defaults
 def todos_update(args: dict) -> dict:
-    if args is None:
-        args = {}
-    todo_id = _validate_string(args, "id", required=True)
-    title = _validate_string(args, "title")
-    description = _validate_string(args, "description")
-    due_date = _validate_string(args, "dueDate")
-    labels = _validate_string_array(args, "labels")
-    completed = _validate_bool(args, "completed")
-
-    todo = _todos.get(todo_id)
-    if not todo:
-        return {
-            "ok": False,
-            "error": {"code": "TODO_NOT_FOUND", "message": f"Todo with id '{todo_id}' not found"},
-        }
+    todo_id, title, description, due_date, labels, completed = _todos_update_args(args)
 
     updates: dict[str, Any] = {}
     if title is not None:
@@ -281,53 +537,101 @@ def todos_update(args: dict) -> dict:
     if completed is not None:
         updates["completed"] = completed
 
-    updated = {**todo, **updates, "updatedAt": _now_iso()}
-    _todos[todo_id] = updated
-    broadcast("updated", {"event": "updated", "todo": updated, "timestamp": updated["updatedAt"]})
+    with _todos_lock:
+        todo = _todos.get(todo_id)
+        if not todo:
+            return _err_not_found(todo_id)
+        _touch_store()
+        updated = todo.copy()
+        if updates:
+            updated.update(updates)
+        updated["updatedAt"] = now = _now_iso()
+        _unindex_todo(todo)
+        _todos[todo_id] = updated
+        _index_todo(updated)
+        if title is not None:
+            _title_lower[todo_id] = title.lower()
+    # Only touching updatedAt is not worth telling watchers about
+    if updates:
+        broadcast("updated", {"event": "updated", "todo": updated, "timestamp": now})
     return {"ok": True, "result": updated}
 
 
+@_defaults
 def todos_delete(args: dict) -> dict:
-    if args is None:
-        args = {}
-    todo_id = _validate_string(args, "id", required=True)
-    todo = _todos.get(todo_id)
-    if not todo:
-        return {
-            "ok": False,
-            "error": {"code": "TODO_NOT_FOUND", "message": f"Todo with id '{todo_id}' not found"},
-        }
-    del _todos[todo_id]
+    (todo_id,) = _todo_id_args(args)
+    with _todos_lock:
+        todo = _todos.pop(todo_id, None)
+        if not todo:
+            return _err_not_found(todo_id)
+        _touch_store()
+        _title_lower.pop(todo_id, None)
+        _unindex_todo(todo)
     broadcast("deleted", {"event": "deleted", "todoId": todo_id, "timestamp": _now_iso()})
     return {"ok": True, "result": {"deleted": True}}
 
 
+@_defaults
 def todos_complete(args: dict) -> dict:
-    if args is None:
-        args = {}
-    todo_id = _validate_string(args, "id", required=True)
-    todo = _todos.get(todo_id)
-    if not todo:
-        return {
-            "ok": False,
-            "error": {"code": "TODO_NOT_FOUND", "message": f"Todo with id '{todo_id}' not found"},
-        }
-
-    if not todo.get("completed"):
+    (todo_id,) = _todo_id_args(args)
+    with _todos_lock:
+        todo = _todos.get(todo_id)
+        if not todo:
+            return _err_not_found(todo_id)
+        if todo.get("completed"):
+            return {"ok": True, "result": todo}
+        _touch_store()
         now = _now_iso()
-        todo["completed"] = True
-        todo["completedAt"] = now
-        todo["updatedAt"] = now
+        _mark_completed(todo)
+        todo = {**todo, "completed": True, "completedAt": now, "updatedAt": now}
         _todos[todo_id] = todo
-        broadcast("completed", {"event": "completed", "todo": todo, "timestamp": now})
+
+    broadcast("completed", {"event": "completed", "todo": todo, "timestamp": now})
 
     return {"ok": True, "result": todo}
 
 
+# Recent exports by (format, store version). Filled from the scheduler thread
+# and cleared by reset_storage, so every access holds _todos_lock; only the
+# serialization itself runs unlocked. Chunks are never mutated, so instances
+# can share them.
+_EXPORT_CACHE_SIZE = 4
+_export_cache: OrderedDict[tuple[str, int], tuple[str, list[Chunk], int]] = OrderedDict()
+
+
+def _export_todos(fmt: str) -> tuple[str, list[Chunk], int]:
+    with _todos_lock:
+        key = (fmt, _store_version)
+        cached = _export_cache.get(key)
+        if cached is not None:
+            _export_cache.move_to_end(key)
+            return cached
+        items = list(_todos.values())
+
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(("id", "title", "completed", "createdAt"))
+        for t in items:
+            writer.writerow((t["id"], t["title"], "true" if t["completed"] else "false", t["createdAt"]))
+        # No terminator after the last row, as before
+        data = buf.getvalue()[:-1]
+    else:
+        data = orjson.dumps(items).decode()
+
+    entry = (data, build_chunks(data), len(items))
+    # A reset since the snapshot bumped the version, so a stale key is
+    # simply never hit again and ages out.
+    with _todos_lock:
+        _export_cache[key] = entry
+        if len(_export_cache) > _EXPORT_CACHE_SIZE:
+            _export_cache.popitem(last=False)
+    return entry
+
+
+@_defaults
 def todos_export(args: dict, request_id: str) -> dict:
-    if args is None:
-        args = {}
-    fmt = _validate_enum(args, "format", ["csv", "json"], default="csv")
+    (fmt,) = _todos_export_args(args)
 
     instance = create_instance(request_id, "v1:todos.export")
 
@@ -335,35 +639,22 @@ def todos_export(args: dict, request_id: str) -> dict:
         transition_to(request_id, "pending")
 
         def _finish():
-            items = list(_todos.values())
-            if fmt == "csv":
-                header = "id,title,completed,createdAt"
-                rows = [f"{t['id']},{t['title']},{str(t['completed']).lower()},{t['createdAt']}" for t in items]
-                data = "\n".join([header] + rows)
-            else:
-                import json
-                data = json.dumps(items)
-            chunks = build_chunks(data)
+            data, chunks, count = _export_todos(fmt)
             transition_to(request_id, "complete", {
-                "result": {"format": fmt, "data": data, "count": len(items)},
+                "result": {"format": fmt, "data": data, "count": count},
                 "chunks": chunks,
             })
 
-        timer2 = threading.Timer(0.05, _finish)
-        timer2.daemon = True
-        timer2.start()
+        _scheduler.schedule(0.05, _finish)
 
-    timer1 = threading.Timer(0.05, _do_work)
-    timer1.daemon = True
-    timer1.start()
+    _scheduler.schedule(0.05, _do_work)
 
     return {"ok": True, "async": True, "requestId": instance.request_id}
 
 
+@_defaults
 def reports_generate(args: dict, request_id: str) -> dict:
-    if args is None:
-        args = {}
-    report_type = _validate_enum(args, "type", ["summary", "detailed"], default="summary")
+    (report_type,) = _reports_generate_args(args)
 
     instance = create_instance(request_id, "v1:reports.generate")
 
@@ -371,7 +662,8 @@ def reports_generate(args: dict, request_id: str) -> dict:
         transition_to(request_id, "pending")
 
         def _finish():
-            items = list(_todos.values())
+            with _todos_lock:
+                items = list(_todos.values())
             completed_count = sum(1 for t in items if t.get("completed"))
             transition_to(request_id, "complete", {
                 "result": {
@@ -383,68 +675,77 @@ def reports_generate(args: dict, request_id: str) -> dict:
                 },
             })
 
-        timer2 = threading.Timer(0.05, _finish)
-        timer2.daemon = True
-        timer2.start()
+        _scheduler.schedule(0.05, _finish)
 
-    timer1 = threading.Timer(0.05, _do_work)
-    timer1.daemon = True
-    timer1.start()
+    _scheduler.schedule(0.05, _do_work)
 
     return {"ok": True, "async": True, "requestId": instance.request_id}
 
 
+@_defaults
 def todos_search(args: dict) -> dict:
-    if args is None:
-        args = {}
-    query = _validate_string(args, "query", required=True)
-    limit = _validate_int(args, "limit", minimum=1, maximum=100, default=20)
-
-    items = [t for t in _todos.values() if query.lower() in t.get("title", "").lower()]
+    query, limit = _todos_search_args(args)
+
+    q = query.lower()
+    items: list[dict] = []
+    total = 0
+    for todo_id, title_lower in _title_lower.items():
+        if q in title_lower:
+            total += 1
+            if len(items) < limit:
+                items.append(_todos[todo_id])
     return {
         "ok": True,
-        "result": {"items": items[:limit], "cursor": None, "total": len(items)},
+        "result": {"items": items, "cursor": None, "total": total},
     }
 
 
+@_defaults
 def debug_simulate_error(args: dict) -> dict:
-    if args is None:
-        args = {}
-    status_code = _validate_int(args, "statusCode", required=True)
-    code = _validate_string(args, "code") or "SIMULATED_ERROR"
-    message = _validate_string(args, "message") or "Simulated error for testing"
+    status_code, code, message = _debug_simulate_error_args(args)
+    code = code or "SIMULATED_ERROR"
+    message = message or "Simulated error for testing"
     raise ServerError(status_code, code, message)
 
 
+@_defaults
 def todos_watch(args: dict) -> dict:
-    if args is None:
-        args = {}
-    _validate_enum(args, "filter", ["all", "completed", "pending"], default="all")
+    _todos_watch_args(args)
     session_id = str(uuid.uuid4())
     register_stream_session(session_id)
     return {"ok": True, "stream": True, "sessionId": session_id}
 
 
+def _set_attachment(todo_id: str, media_id: str) -> bool:
+    """Point the todo at media_id; False if the todo is gone by now."""
+    with _todos_lock:
+        todo = _todos.get(todo_id)
+        if todo is None:
+            return False
+        _touch_store()
+        _todos[todo_id] = {
+            **todo,
+            "attachmentId": media_id,
+            "location": {"uri": f"/media/{media_id}"},
+            "updatedAt": _now_iso(),
+        }
+        return True
+
+
+@_defaults
 def todos_attach(args: dict, media_file: Optional[dict] = None) -> dict:
-    if args is None:
-        args = {}
-    todo_id = _validate_string(args, "todoId", required=True)
-    ref = _validate_string(args, "ref")
+    todo_id, ref = _todos_attach_args(args)
 
     todo = _todos.get(todo_id)
     if not todo:
-        return {
-            "ok": False,
-            "error": {"code": "TODO_NOT_FOUND", "message": f"Todo with id '{todo_id}' not found"},
-        }
+        return _err_not_found(todo_id)
 
     # Handle ref URI
     if ref:
-        media = store_media(b"", "application/octet-stream", ref)
-        todo["attachmentId"] = media.id
-        todo["location"] = {"uri": f"/media/{media.id}"}
-        todo["updatedAt"] = _now_iso()
-        _todos[todo_id] = todo
+        media = store_media_ref("application/octet-stream", ref)
+        if not _set_attachment(todo_id, media.id):
+            discard_media(media.id)
+            return _err_not_found(todo_id)
         return {
             "ok": True,
             "result": {
@@ -463,27 +764,31 @@ def todos_attach(args: dict, media_file: Optional[dict] = None) -> dict:
         }
 
     # Normalize content type (strip parameters like charset)
-    base_content_type = media_file["content_type"].split(";")[0].strip()
+    content_type = media_file["content_type"]
+    i = content_type.find(";")
+    base_content_type = (content_type if i < 0 else content_type[:i]).strip()
     if base_content_type not in ACCEPTED_MEDIA_TYPES:
         return {
             "ok": False,
             "error": {
                 "code": "UNSUPPORTED_MEDIA_TYPE",
-                "message": f"Unsupported media type: {base_content_type}. Accepted: {', '.join(ACCEPTED_MEDIA_TYPES)}",
+                "message": f"Unsupported media type: {base_content_type}. Accepted: {ACCEPTED_MEDIA_TYPES_TEXT}",
             },
         }
 
-    if len(media_file["data"]) > MAX_MEDIA_BYTES:
+    if media_file["size"] > MAX_MEDIA_BYTES:
         return {
             "ok": False,
             "error": {"code": "MEDIA_TOO_LARGE", "message": f"File exceeds maximum size of {MAX_MEDIA_BYTES} bytes"},
         }
 
-    media = store_media(media_file["data"], base_content_type, media_file["filename"])
-    todo["attachmentId"] = media.id
-    todo["location"] = {"uri": f"/media/{media.id}"}
-    todo["updatedAt"] = _now_iso()
-    _todos[todo_id] = todo
+    # Take the spill file over; the HTTP layer deletes it if it is left behind
+    path = media_file["path"]
+    media_file["path"] = None
+    media = store_media(path, media_file["size"], base_content_type, media_file["filename"])
+    if not _set_attachment(todo_id, media.id):
+        discard_media(media.id)
+        return _err_not_found(todo_id)
 
     return {
         "ok": True,
@@ -578,3 +883,50 @@ OPERATIONS: dict[str, dict[str, Any]] = {
         "execution_model": "stream",
     },
 }
+
+
+@dataclass(slots=True, frozen=True)
+class Operation:
+    """One OPERATIONS entry flattened into slots for the dispatch hot path."""
+
+    name: str
+    handler: Optional[Callable[..., dict]]
+    async_handler: Optional[Callable[..., dict]]
+    stream_handler: Optional[Callable[..., dict]]
+    side_effecting: bool
+    auth_scopes: tuple[str, ...]
+    execution_model: str
+    accepts_media: bool
+    deprecated: bool
+    sunset: Optional[str]
+    sunset_ts: Optional[float]  # epoch seconds, set only for deprecated ops
+    replacement: Optional[str]
+
+    @classmethod
+    def from_spec(cls, name: str, spec: dict[str, Any]) -> Operation:
+        deprecated = bool(spec.get("deprecated"))
+        sunset = spec.get("sunset")
+        return cls(
+            # Op names contain ':' and '.', so the compiler does not intern them
+            name=sys.intern(name),
+            handler=spec.get("handler"),
+            async_handler=spec.get("async_handler"),
+            stream_handler=spec.get("stream_handler"),
+            side_effecting=bool(spec.get("side_effecting")),
+            auth_scopes=tuple(spec.get("auth_scopes", ())),
+            execution_model=spec.get("execution_model", "sync"),
+            accepts_media=bool(spec.get("accepts_media")),
+            deprecated=deprecated,
+            sunset=sunset,
+            # Parsed once; a naive date is local time, so compare with time.time()
+            sunset_ts=datetime.fromisoformat(sunset).timestamp() if deprecated and sunset else None,
+            replacement=spec.get("replacement"),
+        )
+
+
+# The router resolves an op name to an opcode once, then indexes the table.
+# OPERATIONS stays the source of truth for introspection.
+OPERATIONS_TABLE: tuple[Operation, ...] = tuple(
+    Operation.from_spec(name, spec) for name, spec in OPERATIONS.items()
+)
+OPERATIONS_BY_NAME: dict[str, int] = {rec.name: i for i, rec in enumerate(OPERATIONS_TABLE)}
@@ -5,6 +5,11 @@ JSON Schema definitions match the exact output of zod-to-json-schema.
 
 from __future__ import annotations
 
+from types import MappingProxyType
+from typing import Any, Mapping
+
+import orjson
+
 # ---------------------------------------------------------------------------
 # Shared sub-schemas
 # ---------------------------------------------------------------------------
@@ -78,7 +83,7 @@ _WATCH_TODOS_FRAME_SCHEMA = {
 # Builder
 # ---------------------------------------------------------------------------
 
-def build_registry() -> dict:
+def _build_registry() -> dict:
     return {
         "callVersion": "2026-02-10",
         "operations": [
@@ -378,3 +383,27 @@ def build_registry() -> dict:
             },
         ],
     }
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively turn dicts into read-only mappings and lists into tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+# Nothing in the registry varies at runtime, so it is built, frozen and
+# serialized once at import. The shared sub-schemas appear under several
+# operations; orjson's default=dict handles the read-only mappings.
+_REGISTRY: Mapping[str, Any] = _freeze(_build_registry())
+_REGISTRY_JSON: bytes = orjson.dumps(_REGISTRY, default=dict)
+
+
+def build_registry() -> Mapping[str, Any]:
+    return _REGISTRY
+
+
+def registry_bytes() -> bytes:
+    return _REGISTRY_JSON
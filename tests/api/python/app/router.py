@@ -6,10 +6,38 @@ from __future__ import annotations
 
 import time
 import uuid
-from datetime import datetime
 from typing import Any, Optional
 
-from .operations import OPERATIONS, get_idempotency_store, ValidationError, ServerError
+import orjson
+
+from .operations import (
+    OPERATIONS_BY_NAME,
+    OPERATIONS_TABLE,
+    get_idempotency_store,
+    store_idempotent_response,
+    ValidationError,
+    ServerError,
+)
+
+
+def _body(request_id: str, session_id: Optional[str], state: str) -> dict[str, Any]:
+    """Response body head: requestId, sessionId when given, then state."""
+    body: dict[str, Any] = {"requestId": request_id}
+    if session_id:
+        body["sessionId"] = session_id
+    body["state"] = state
+    return body
+
+
+def _err(
+    request_id: str,
+    session_id: Optional[str],
+    status: int,
+    error: dict[str, Any],
+) -> dict:
+    body = _body(request_id, session_id, "error")
+    body["error"] = error
+    return {"status": status, "body": body}
 
 
 def handle_call(
@@ -19,6 +47,10 @@ def handle_call(
 ) -> dict:
     """
     Process a /call request envelope and return {"status": int, "body": dict}.
+
+    Sync operation responses also carry "body_bytes", the body already
+    serialized, which the HTTP layer writes as-is. Idempotent replays carry
+    only "status" and "body_bytes".
     """
     from .auth import validate_auth
 
@@ -26,190 +58,121 @@ def handle_call(
     request_id = ctx.get("requestId") or str(uuid.uuid4())
     session_id = ctx.get("sessionId")
 
-    base: dict[str, Any] = {"requestId": request_id}
-    if session_id:
-        base["sessionId"] = session_id
-
     # Validate op is present and a string
     op = envelope.get("op")
-    if not op or not isinstance(op, str):
-        return {
-            "status": 400,
-            "body": {
-                **base,
-                "state": "error",
-                "error": {
-                    "code": "INVALID_REQUEST",
-                    "message": "Missing or invalid 'op' field",
-                },
-            },
-        }
+    if type(op) is not str or not op:
+        return _err(request_id, session_id, 400, {
+            "code": "INVALID_REQUEST",
+            "message": "Missing or invalid 'op' field",
+        })
 
     # Look up operation
-    operation = OPERATIONS.get(op)
-    if operation is None:
-        return {
-            "status": 400,
-            "body": {
-                **base,
-                "state": "error",
-                "error": {
-                    "code": "UNKNOWN_OP",
-                    "message": f"Unknown operation: {op}",
-                },
-            },
-        }
+    opcode = OPERATIONS_BY_NAME.get(op)
+    if opcode is None:
+        return _err(request_id, session_id, 400, {
+            "code": "UNKNOWN_OP",
+            "message": f"Unknown operation: {op}",
+        })
+
+    operation = OPERATIONS_TABLE[opcode]
+    side_effecting = operation.side_effecting
+    execution_model = operation.execution_model
 
     # Deprecated check -- past sunset date means 410
-    if operation.get("deprecated") and operation.get("sunset"):
-        sunset_date = datetime.fromisoformat(operation["sunset"])
-        if datetime.now() > sunset_date:
-            return {
-                "status": 410,
-                "body": {
-                    **base,
-                    "state": "error",
-                    "error": {
-                        "code": "OP_REMOVED",
-                        "message": f"Operation {op} has been removed",
-                        "cause": {
-                            "removedOp": op,
-                            "replacement": operation.get("replacement"),
-                        },
-                    },
-                },
-            }
+    if operation.sunset_ts is not None and time.time() > operation.sunset_ts:
+        return _err(request_id, session_id, 410, {
+            "code": "OP_REMOVED",
+            "message": f"Operation {op} has been removed",
+            "cause": {
+                "removedOp": op,
+                "replacement": operation.replacement,
+            },
+        })
 
     # Auth check
-    auth_scopes = operation.get("auth_scopes", [])
+    auth_scopes = operation.auth_scopes
     if auth_scopes:
         auth_result = validate_auth(auth_header, auth_scopes)
         if not auth_result["valid"]:
-            return {
-                "status": auth_result["status"],
-                "body": {
-                    **base,
-                    "state": "error",
-                    "error": {
-                        "code": auth_result["code"],
-                        "message": auth_result["message"],
-                    },
-                },
-            }
+            return _err(request_id, session_id, auth_result["status"], {
+                "code": auth_result["code"],
+                "message": auth_result["message"],
+            })
 
     # Idempotency check for side-effecting ops
     idempotency_key = ctx.get("idempotencyKey")
-    if operation.get("side_effecting") and idempotency_key:
+    if side_effecting and idempotency_key:
         store = get_idempotency_store()
         cached = store.get(idempotency_key)
         if cached is not None:
-            return cached
+            status, body_bytes = cached
+            return {"status": status, "body_bytes": body_bytes}
 
     # Execute handler
     args = envelope.get("args") or {}
 
     try:
         # Stream operations
-        if operation.get("execution_model") == "stream" and "stream_handler" in operation:
-            stream_result = operation["stream_handler"](args)
+        if execution_model == "stream" and operation.stream_handler is not None:
+            stream_result = operation.stream_handler(args)
             if not stream_result.get("ok"):
-                return {
-                    "status": 200,
-                    "body": {**base, "state": "error", "error": stream_result["error"]},
-                }
-            return {
-                "status": 202,
-                "body": {
-                    **base,
-                    "state": "streaming",
-                    "stream": {
-                        "transport": "wss",
-                        "location": f"/streams/{stream_result['sessionId']}",
-                        "sessionId": stream_result["sessionId"],
-                        "encoding": "json",
-                        "expiresAt": int(time.time()) + 3600,
-                    },
-                },
+                return _err(request_id, session_id, 200, stream_result["error"])
+            body = _body(request_id, session_id, "streaming")
+            body["stream"] = {
+                "transport": "wss",
+                "location": f"/streams/{stream_result['sessionId']}",
+                "sessionId": stream_result["sessionId"],
+                "encoding": "json",
+                "expiresAt": int(time.time()) + 3600,
             }
+            return {"status": 202, "body": body}
 
         # Async operations
-        if operation.get("execution_model") == "async" and "async_handler" in operation:
-            async_result = operation["async_handler"](args, request_id)
+        if execution_model == "async" and operation.async_handler is not None:
+            async_result = operation.async_handler(args, request_id)
             if not async_result.get("ok"):
-                return {
-                    "status": 200,
-                    "body": {**base, "state": "error", "error": async_result["error"]},
-                }
-            return {
-                "status": 202,
-                "body": {
-                    **base,
-                    "state": "accepted",
-                    "retryAfterMs": 100,
-                    "expiresAt": int(time.time()) + 3600,
-                },
-            }
+                return _err(request_id, session_id, 200, async_result["error"])
+            body = _body(request_id, session_id, "accepted")
+            body["retryAfterMs"] = 100
+            body["expiresAt"] = int(time.time()) + 3600
+            return {"status": 202, "body": body}
 
         # Sync operations
-        handler = operation["handler"]
-        if operation.get("accepts_media"):
+        handler = operation.handler
+        if operation.accepts_media:
             result = handler(args, media_file)
         else:
             result = handler(args)
 
         if result["ok"]:
-            response = {
-                "status": 200,
-                "body": {**base, "state": "complete", "result": result["result"]},
-            }
+            body = _body(request_id, session_id, "complete")
+            body["result"] = result["result"]
         else:
             # Domain error -- HTTP 200
-            response = {
-                "status": 200,
-                "body": {**base, "state": "error", "error": result["error"]},
-            }
+            body = _body(request_id, session_id, "error")
+            body["error"] = result["error"]
+        body_bytes = orjson.dumps(body)
 
         # Store for idempotency
-        if operation.get("side_effecting") and idempotency_key:
-            get_idempotency_store()[idempotency_key] = response
+        if side_effecting and idempotency_key:
+            store_idempotent_response(idempotency_key, 200, body_bytes)
 
-        return response
+        return {"status": 200, "body": body, "body_bytes": body_bytes}
 
     except ValidationError as err:
-        return {
-            "status": 400,
-            "body": {
-                **base,
-                "state": "error",
-                "error": {
-                    "code": "VALIDATION_ERROR",
-                    "message": err.message,
-                },
-            },
-        }
+        return _err(request_id, session_id, 400, {
+            "code": "VALIDATION_ERROR",
+            "message": err.message,
+        })
 
     except ServerError as err:
-        return {
-            "status": err.status_code,
-            "body": {
-                **base,
-                "state": "error",
-                "error": {
-                    "code": err.code,
-                    "message": err.message,
-                },
-            },
-        }
+        return _err(request_id, session_id, err.status_code, {
+            "code": err.code,
+            "message": err.message,
+        })
 
     except Exception as err:
-        return {
-            "status": 500,
-            "body": {
-                **base,
-                "state": "error",
-                "error": {
-                    "code": "INTERNAL_ERROR",
-                    "message": str(err) if str(err) else "Unknown error",
-                },
-            },
-        }
+        return _err(request_id, session_id, 500, {
+            "code": "INTERNAL_ERROR",
+            "message": str(err) if str(err) else "Unknown error",
+        })
@@ -4,10 +4,13 @@ Operation instance state machine with chunked retrieval support.
 
 from __future__ import annotations
 
-import hashlib
 import base64
+import functools
+import os
 import time
-from typing import Optional, Any
+from collections import OrderedDict
+from hashlib import sha256 as _sha256  # OpenSSL's constructor when available
+from typing import Any, Optional, Union
 
 
 class Chunk:
@@ -43,7 +46,7 @@ class Chunk:
 class OperationInstance:
     __slots__ = (
         "request_id", "op", "state", "result", "error",
-        "retry_after_ms", "created_at", "expires_at", "chunks",
+        "retry_after_ms", "created_at", "expires_at", "chunks", "offset_to_index",
     )
 
     def __init__(self, request_id: str, op: str):
@@ -53,18 +56,24 @@ class OperationInstance:
         self.result: Any = None
         self.error: Optional[dict] = None
         self.retry_after_ms = 100
-        self.created_at = int(time.time())
-        self.expires_at = int(time.time()) + 3600
+        now = int(time.time())
+        self.created_at = now
+        self.expires_at = now + 3600
         self.chunks: Optional[list[Chunk]] = None
+        self.offset_to_index: dict[int, int] = {}
 
 
-# In-memory store
-_instances: dict[str, OperationInstance] = {}
+# In-memory store, oldest first; past MAX_INSTANCES the oldest is dropped
+MAX_INSTANCES = int(os.environ.get("MAX_INSTANCES", "10000"))
+_instances: OrderedDict[str, OperationInstance] = OrderedDict()
 
 
 def create_instance(request_id: str, op: str) -> OperationInstance:
     instance = OperationInstance(request_id, op)
     _instances[request_id] = instance
+    _instances.move_to_end(request_id)  # a reused requestId counts as new
+    if len(_instances) > MAX_INSTANCES:
+        _instances.popitem(last=False)
     return instance
 
 
@@ -84,6 +93,7 @@ def transition_to(
             instance.error = data["error"]
         if "chunks" in data:
             instance.chunks = data["chunks"]
+            instance.offset_to_index = {c.offset: i for i, c in enumerate(instance.chunks)}
     return instance
 
 
@@ -95,35 +105,54 @@ def reset_instances() -> None:
     _instances.clear()
 
 
-def compute_sha256(data: str) -> str:
-    h = hashlib.sha256(data.encode("utf-8")).hexdigest()
-    return f"sha256:{h}"
+def compute_sha256(data: Union[str, bytes, memoryview]) -> str:
+    """Checksum of text (hashed as UTF-8) or of bytes as given, unencoded."""
+    if type(data) is str:
+        data = data.encode("utf-8")
+    return "sha256:" + _sha256(data).hexdigest()
+
+
+@functools.lru_cache(maxsize=4096)
+def _chunk_cursor(end: int) -> str:
+    # Ends repeat across exports (multiples of the chunk size), so cache them
+    return base64.b64encode(str(end).encode()).decode()
 
 
 def build_chunks(data: str, chunk_size: int = 512) -> list[Chunk]:
-    chunks: list[Chunk] = []
-    offset = 0
+    n = len(data)
+    if not n:
+        return []
+    count = -(-n // chunk_size)
+    chunks: list[Chunk] = [None] * count  # type: ignore[list-item]
     previous_checksum: Optional[str] = None
-
-    while offset < len(data):
-        end = min(offset + chunk_size, len(data))
+    # Offsets count characters. For ASCII text they match byte offsets, so
+    # encode once and hash zero-copy slices instead of re-encoding each chunk.
+    raw = memoryview(data.encode("ascii")) if data.isascii() else None
+
+    # Every chunk but the last is a full "partial" one; the tail is peeled
+    # off below, so the loop carries no is-last test.
+    last = (count - 1) * chunk_size
+    for i, offset in enumerate(range(0, last, chunk_size)):
+        end = offset + chunk_size
         chunk_data = data[offset:end]
-        checksum = compute_sha256(chunk_data)
-        is_last = end >= len(data)
-        cursor = None if is_last else base64.b64encode(str(end).encode()).decode()
-
-        chunks.append(
-            Chunk(
-                offset=offset,
-                data=chunk_data,
-                checksum=checksum,
-                checksum_previous=previous_checksum,
-                state="complete" if is_last else "partial",
-                cursor=cursor,
-            )
+        checksum = compute_sha256(chunk_data if raw is None else raw[offset:end])
+        chunks[i] = Chunk(
+            offset=offset,
+            data=chunk_data,
+            checksum=checksum,
+            checksum_previous=previous_checksum,
+            state="partial",
+            cursor=_chunk_cursor(end),
         )
-
         previous_checksum = checksum
-        offset = end
 
+    chunk_data = data[last:]
+    chunks[-1] = Chunk(
+        offset=last,
+        data=chunk_data,
+        checksum=compute_sha256(chunk_data if raw is None else raw[last:]),
+        checksum_previous=previous_checksum,
+        state="complete",
+        cursor=None,
+    )
     return chunks